@@ -0,0 +1,126 @@
+"""
+Benchmark the startup time of the hook entry points.
+
+The git hooks invoke `ooxml-store` and `prettify-xml` many times per git operation,
+so interpreter startup plus import time dominates small commits.
+
+Usage:
+
+    python benchmarks/startup_time.py [--repeat N] [--target-ms MS] [--documents N]
+
+Creates a temporary worktree with a small store of N generated documents, then runs a no-op
+`ooxml-store status` against it and `prettify-xml --help`, in fresh interpreters.
+Exits with a non-zero status if the median time for `ooxml-store status` exceeds the target.
+The package is byte-compiled first, as it would be when installed.
+
+"""
+
+import os
+import sys
+import time
+import argparse
+import compileall
+import statistics
+import subprocess
+import tempfile
+import zipfile
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGET_COMMAND = 'ooxml-store status'
+# Store the generated documents without pandoc, which is not needed to time status:
+STORE_CODE = (
+    "import sys\n"
+    "from ooxml_git_hooks.store import store_file\n"
+    "for fn in sys.argv[1:]:\n"
+    "    store_file(fn, pandoc_fnfmt=None, text_dirfmt=None, verbose=0)\n"
+)
+DOCUMENT_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/word/document.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="word/document.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'),
+    'word/document.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        '<w:body><w:p><w:r><w:t>Document {number}</w:t></w:r></w:p></w:body></w:document>'),
+}
+COMMANDS = {
+    'ooxml-store status': "from ooxml_git_hooks.store import cli; cli(['status'])",
+    'prettify-xml --help': "from ooxml_git_hooks.cli import prettify_xml_cli; prettify_xml_cli(['--help'])",
+}
+
+
+def make_worktree(directory, documents, env):
+    """Create `documents` minimal .docx files in directory, and store them in its .ooxml_store/."""
+    filenames = []
+    for number in range(documents):
+        filename = "document%03d.docx" % (number,)
+        with zipfile.ZipFile(os.path.join(directory, filename), 'w', zipfile.ZIP_DEFLATED) as zipfd:
+            for name, content in DOCUMENT_PARTS.items():
+                zipfd.writestr(name, content.format(number=number))
+        filenames.append(filename)
+    os.mkdir(os.path.join(directory, '.ooxml_store'))
+    subprocess.run([sys.executable, "-c", STORE_CODE] + filenames, cwd=directory, env=env, check=True)
+
+
+def time_command(code, repeat, cwd, env):
+    # One untimed run first, e.g. to create the status cache:
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=cwd, env=env, check=True, stdout=subprocess.PIPE).stdout
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--target-ms', type=float, default=100)
+    parser.add_argument('--documents', type=int, default=40, help="Number of documents in the generated store.")
+    args = parser.parse_args()
+
+    compileall.compile_dir(os.path.join(PACKAGE_DIR, 'ooxml_git_hooks'), quiet=1)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [PACKAGE_DIR, env.get('PYTHONPATH')]))
+
+    baseline, _ = time_command("pass", args.repeat, cwd=None, env=env)
+    baseline_ms = statistics.median(baseline) * 1000
+    print("%-22s median %6.1f ms  (interpreter startup)" % ("python -c pass", baseline_ms))
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        make_worktree(tempdir, args.documents, env=env)
+        for name, code in COMMANDS.items():
+            timings, output = time_command(code, args.repeat, cwd=tempdir, env=env)
+            median_ms = statistics.median(timings) * 1000
+            print("%-22s median %6.1f ms, min %6.1f ms, %+6.1f ms over startup" % (
+                name, median_ms, min(timings) * 1000, median_ms - baseline_ms))
+            if name == TARGET_COMMAND:
+                target_median_ms = median_ms
+                if output.strip():
+                    # The documents have not changed since they were stored, so status should print nothing:
+                    print("WARNING: %r was not a no-op:\n%s" % (name, output.decode()))
+
+    margin_ms = args.target_ms - target_median_ms
+    print("%r median vs. target of %s ms (%s documents): margin %+.1f ms (%.0f%%)" % (
+        TARGET_COMMAND, args.target_ms, args.documents, margin_ms, 100 * margin_ms / args.target_ms))
+    if margin_ms < 0:
+        print("FAILED: Median %r time exceeds target of %s ms." % (TARGET_COMMAND, args.target_ms))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,161 @@
+import os
+import sys
+import click
 
+from .utils import prettyprint_xml, prettify_xml_file, find_xml_parts
 
 
-import sys
-import click
+def expand_inputs(files, output_dir=None, in_place=False):
+    """Expand directories to their XML parts, returning a list of (inputfn, outputfn) tuples.
+
+    If output_dir is given, the input files are mirrored relative to the common root of the inputs,
+    i.e. the common parent of all directory arguments and the directories of all file arguments.
+    E.g. `A.docx.store B.xlsx.store` are mirrored as `<output_dir>/A.docx.store/...` and `<output_dir>/B.xlsx.store/...`,
+    while a single directory argument is mirrored as its contents.
+    Files given more than once (e.g. via overlapping directories) are only included once.
+    """
+    inputfns = []
+    for path in files:
+        if os.path.isdir(path):
+            inputfns.extend(sorted(find_xml_parts(path)))
+        else:
+            inputfns.append(path)
+    root = None
+    if output_dir and files:
+        root = os.path.commonpath([
+            os.path.abspath(path if os.path.isdir(path) else os.path.dirname(path) or os.curdir) for path in files])
+    tasks = []
+    seen = set()
+    for inputfn in inputfns:
+        abspath = os.path.normcase(os.path.abspath(inputfn))
+        if abspath in seen:
+            continue
+        seen.add(abspath)
+        if in_place:
+            outputfn = inputfn
+        elif output_dir:
+            outputfn = os.path.join(output_dir, os.path.relpath(os.path.abspath(inputfn), start=root))
+        else:
+            outputfn = None
+        tasks.append((inputfn, outputfn))
+    return tasks
+
+
+def duplicate_outputs(tasks):
+    """Return the output filenames that more than one input file would be written to."""
+    inputfns = {}
+    for inputfn, outputfn in tasks:
+        if outputfn is not None:
+            inputfns.setdefault(os.path.normcase(os.path.abspath(outputfn)), []).append(inputfn)
+    return sorted(outputfn for outputfn, fns in inputfns.items() if len(fns) > 1)
+
 
-from .utils import prettyprint_xml
+def store_archive_files(paths):
+    """Return the paths that are inside the archive directory of a store, e.g. `file.docx.store/.zip/`."""
+    from .store import FILE_METADATA_FN, DEFAULT_METADATA
+    archive_name = DEFAULT_METADATA['archive']
+    is_archive_dir = {}
+
+    def in_archive(dirpath):
+        if dirpath not in is_archive_dir:
+            parent = os.path.dirname(dirpath)
+            if os.path.basename(dirpath) == archive_name and os.path.isfile(os.path.join(parent, FILE_METADATA_FN)):
+                is_archive_dir[dirpath] = True
+            else:
+                is_archive_dir[dirpath] = parent != dirpath and in_archive(parent)
+        return is_archive_dir[dirpath]
+
+    return [path for path in paths if in_archive(os.path.dirname(os.path.abspath(path)))]
+
+
+def _prettify_task(inputfn, outputfn, method, indent):
+    # Errors are returned rather than raised, so a single malformed file does not stop a batch.
+    try:
+        return inputfn, prettify_xml_file(inputfn, outputfn, method=method, indent=indent), None
+    except Exception as exc:
+        return inputfn, None, "%s: %s" % (type(exc).__name__, exc)
+
+
+def prettify_files(tasks, method=None, indent=" "*4, jobs=None):
+    """Prettify a list of (inputfn, outputfn) tuples, yielding the results in order as they become available.
+
+    The files are distributed across worker processes, unless there is only one file or jobs is 1.
+
+    Yields:
+        (inputfn, result, error) tuples, where result is the return value of `prettify_xml_file`,
+        or None if the file could not be prettified, in which case error is the error message.
+    """
+    if jobs == 1 or len(tasks) < 2:
+        for inputfn, outputfn in tasks:
+            yield _prettify_task(inputfn, outputfn, method, indent)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    inputfns, outputfns = zip(*tasks)
+    n = len(tasks)
+    # Small chunks keep the results streaming, while avoiding per-file IPC overhead for many small parts:
+    chunksize = max(1, n // (4 * (jobs or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(
+            _prettify_task, inputfns, outputfns, [method] * n, [indent] * n, chunksize=chunksize)
 
 
 @click.command()
 @click.argument('files', nargs=-1)
 @click.option('--outputfn')
+@click.option('--output-dir', help="Write prettified files to a mirror tree in this directory.")
+@click.option('--in-place', '-i', is_flag=True, default=False, help="Overwrite the input files.")
+@click.option('--jobs', '-j', type=int, default=None, help="Number of worker processes.")
 @click.option('--method')
 @click.option('--indent', default=" "*4)
-def prettify_xml_cli(files, outputfn=None, method=None, indent=" "*4):
+def prettify_xml_cli(files, outputfn=None, output_dir=None, in_place=False, jobs=None, method=None, indent=" "*4):
+    """Prettify XML files. Directories (e.g. a .store directory) are expanded to all XML parts.
+
+    Files that cannot be prettified are reported on stderr, and the exit status is 1 once all files are processed.
+    """
     if not files:
         files = ("-",)
-    print("Files:", files)
-    for inputfn in files:
-        if inputfn is None or inputfn == "-":
-            text = sys.stdin.read()
+    if in_place or output_dir:
+        tasks = expand_inputs([fn for fn in files if fn != "-"], output_dir=output_dir, in_place=in_place)
+        duplicates = duplicate_outputs(tasks)
+        if duplicates:
+            raise click.UsageError(
+                "%s output file(s) would be written by more than one input file, e.g. %r." % (
+                    len(duplicates), duplicates[0]))
+        if in_place:
+            archive_files = store_archive_files([inputfn for inputfn, _ in tasks])
+            if archive_files:
+                # Rewriting the archive parts changes the re-created documents and breaks the recorded member CRCs.
+                raise click.UsageError(
+                    "Refusing to rewrite %s file(s) in a store archive directory in place, e.g. %r. "
+                    "Use --output-dir instead." % (len(archive_files), archive_files[0]))
+        results = prettify_files(tasks, method=method, indent=indent, jobs=jobs)
+        fd = None
+    else:
+        if "-" in files:
+            # Reading from stdin, keep the input order and process files one at a time:
+            results = (
+                ("-", prettyprint_xml(sys.stdin.read(), method=method, indent=indent), None) if inputfn == "-"
+                else _prettify_task(inputfn, None, method, indent)
+                for inputfn in files
+            )
         else:
-            text = open(inputfn).read()
+            results = prettify_files(expand_inputs(files), method=method, indent=indent, jobs=jobs)
+        if outputfn == '-':
+            return next(iter(results))[1]
+        fd = open(outputfn, 'w', encoding='utf-8') if outputfn else sys.stdout
 
-        pretty = prettyprint_xml(text, method=method, indent=indent)
-        if outputfn is None:
-            print(pretty)
-        elif outputfn == '-':
-            return pretty
-        else:
-            with open(outputfn, 'w') as fd:
-                fd.write(pretty)
+    failed = 0
+    try:
+        # Results are handled as soon as they are available:
+        for inputfn, pretty, error in results:
+            if error:
+                print("ERROR: %s: %s" % (inputfn, error), file=sys.stderr)
+                failed += 1
+            elif fd is not None:
+                print(pretty, file=fd)
+    finally:
+        if fd is not None and fd is not sys.stdout:
+            fd.close()
+    if failed:
+        print("%s file(s) could not be prettified." % (failed,), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,269 @@
+
+"""
+
+Native text export of .xlsx and .pptx files, which pandoc cannot read.
+
+The parts are read directly from the zip archive with `iterparse`, so memory use is bounded
+by the shared strings table (xlsx) or a single slide (pptx), not by the size of the document.
+
+* xlsx: One tab-separated (or comma-separated) text file per worksheet, in workbook order.
+* pptx: One plain-text outline per slide, with paragraphs indented by their outline level.
+
+"""
+
+import os
+import re
+import csv
+import zipfile
+import posixpath
+from xml.etree.ElementTree import iterparse
+
+
+def local_name(tag):
+    """Return the tag without namespace, e.g. '{http://...}row' -> 'row'."""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _rel_id(elem):
+    # The r:id attribute; matching on local name also supports the "strict" OOXML namespaces.
+    for key, value in elem.attrib.items():
+        if key.startswith('{') and local_name(key) == 'id':
+            return value
+    return None
+
+
+def read_relationships(zipfd, partname):
+    """Return {rId: (type, target partname)} for the relationships of a part, e.g. 'xl/workbook.xml'.
+
+    The type is the last component of the relationship type URI, e.g. 'worksheet' or 'sharedStrings',
+    which is the same for the transitional and strict OOXML namespaces.
+    """
+    partdir, fname = posixpath.split(partname)
+    rels_name = posixpath.join(partdir, '_rels', fname + '.rels')
+    rels = {}
+    with zipfd.open(rels_name) as fd:
+        for event, elem in iterparse(fd):
+            if local_name(elem.tag) == 'Relationship' and elem.get('TargetMode') != 'External':
+                target = elem.get('Target')
+                if target.startswith('/'):
+                    target = target.lstrip('/')
+                else:
+                    target = posixpath.normpath(posixpath.join(partdir, target))
+                rels[elem.get('Id')] = (elem.get('Type', '').rsplit('/', 1)[-1], target)
+    return rels
+
+
+def safe_filename(name):
+    """Replace characters that are not safe in filenames."""
+    return re.sub(r'[\\/:*?"<>|]', '_', name).strip() or '_'
+
+
+def unique_filename(name, used):
+    """Return name, or name with a numbered suffix if it is already in `used` (case-insensitively), e.g. 'a_b-2'.
+
+    The returned name is added to `used`.
+    """
+    candidate, number = name, 1
+    while candidate.lower() in used:
+        number += 1
+        candidate = "%s-%s" % (name, number)
+    used.add(candidate.lower())
+    return candidate
+
+
+def column_index(cellref):
+    """Return the zero-based column index of a cell reference, e.g. 'C7' -> 2."""
+    index = 0
+    for char in cellref:
+        if not char.isalpha():
+            break
+        index = index * 26 + (ord(char.upper()) - ord('A') + 1)
+    return index - 1
+
+
+def _text_of(elem, skip=('rPh',)):
+    # Concatenated <t> texts below elem, skipping phonetic runs.
+    parts = []
+    for child in elem:
+        name = local_name(child.tag)
+        if name == 't':
+            parts.append(child.text or '')
+        elif name not in skip:
+            parts.append(_text_of(child, skip=skip))
+    return ''.join(parts)
+
+
+def read_shared_strings(zipfd, partname):
+    """Return the list of shared strings of a workbook, from the given sharedStrings part (may be None)."""
+    strings = []
+    if partname is None or partname not in zipfd.namelist():
+        return strings
+    with zipfd.open(partname) as fd:
+        for event, elem in iterparse(fd):
+            if local_name(elem.tag) == 'si':
+                strings.append(_text_of(elem))
+                elem.clear()
+    return strings
+
+
+def iter_sheet_rows(fd, shared_strings):
+    """Yield each row of a worksheet part as a list of cell value strs.
+
+    Rows that are not present in the part (empty rows) are yielded as empty lists, so row positions match the sheet.
+    """
+    sheet_data = None
+    row_number = 0
+    for event, elem in iterparse(fd, events=('start', 'end')):
+        name = local_name(elem.tag)
+        if event == 'start':
+            if name == 'sheetData':
+                sheet_data = elem
+            continue
+        if name != 'row':
+            continue
+        ref = elem.get('r')
+        if ref:
+            for _ in range(int(ref) - row_number - 1):
+                yield []
+            row_number = int(ref)
+        else:
+            row_number += 1
+        values = []
+        for cell in elem:
+            if local_name(cell.tag) != 'c':
+                continue
+            ref = cell.get('r')
+            col = column_index(ref) if ref else len(values)
+            if col > len(values):
+                values.extend([''] * (col - len(values)))
+            values.append(_cell_value(cell, shared_strings))
+        yield values
+        # Remove the processed row, so memory use does not grow with the sheet size:
+        if sheet_data is not None:
+            sheet_data.remove(elem)
+        else:
+            elem.clear()
+
+
+def _cell_value(cell, shared_strings):
+    celltype = cell.get('t')
+    if celltype == 'inlineStr':
+        return ''.join(_text_of(child) for child in cell if local_name(child.tag) == 'is')
+    value = None
+    for child in cell:
+        if local_name(child.tag) == 'v':
+            value = child.text or ''
+    if value is None:
+        return ''
+    if celltype == 's':
+        return shared_strings[int(value)]
+    if celltype == 'b':
+        return 'TRUE' if value == '1' else 'FALSE'
+    return value
+
+
+def export_xlsx_text(filename, output_dir, delimiter='\t', suffix='.tsv'):
+    """Export each worksheet of an .xlsx file to a delimited text file in output_dir.
+
+    Args:
+        filename: The .xlsx file.
+        output_dir: Directory to write the text files to.
+        delimiter: Field delimiter, e.g. '\\t' (TSV) or ',' (CSV).
+        suffix: Filename suffix of the text files.
+
+    Returns:
+        List of the written filenames.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    with zipfile.ZipFile(filename, 'r') as zipfd:
+        workbook = 'xl/workbook.xml'
+        rels = read_relationships(zipfd, workbook)
+        sheets = []
+        with zipfd.open(workbook) as fd:
+            for event, elem in iterparse(fd):
+                if local_name(elem.tag) == 'sheet':
+                    reltype, partname = rels.get(_rel_id(elem), (None, None))
+                    # Only worksheets have cell data, chart sheets and dialog sheets are skipped:
+                    if reltype == 'worksheet':
+                        sheets.append((elem.get('name'), partname))
+        # The sharedStrings part is found through its relationship type, its name is not fixed:
+        shared_strings_parts = [target for reltype, target in rels.values() if reltype == 'sharedStrings']
+        shared_strings = read_shared_strings(zipfd, shared_strings_parts[0] if shared_strings_parts else None)
+        used_names = set()
+        for sheet_name, partname in sheets:
+            if partname not in zipfd.namelist():
+                continue
+            # Different sheet names, e.g. 'a/b' and 'a:b', can have the same safe filename:
+            output_fn = os.path.join(output_dir, unique_filename(safe_filename(sheet_name), used_names) + suffix)
+            with zipfd.open(partname) as fd, open(output_fn, 'w', encoding='utf-8', newline='') as out:
+                writer = csv.writer(out, delimiter=delimiter, lineterminator='\n')
+                writer.writerows(iter_sheet_rows(fd, shared_strings))
+            written.append(output_fn)
+    return written
+
+
+def iter_slide_outline(fd, indent="    "):
+    """Yield the lines of a plain-text outline of a slide part, one per non-empty paragraph.
+
+    Each shape is followed by an empty line.
+    """
+    shape_has_text = False
+    for event, elem in iterparse(fd):
+        name = local_name(elem.tag)
+        if name == 'p' and 'drawingml' in elem.tag:
+            text = ''.join(
+                (child.text or '') if local_name(child.tag) == 't' else ' '
+                for child in elem.iter() if local_name(child.tag) in ('t', 'br')
+            )
+            if text.strip():
+                level = 0
+                for child in elem:
+                    if local_name(child.tag) == 'pPr':
+                        level = int(child.get('lvl', 0))
+                yield indent * level + text
+                shape_has_text = True
+            elem.clear()
+        elif name in ('sp', 'graphicFrame') and shape_has_text:
+            yield ''
+            shape_has_text = False
+
+
+def export_pptx_text(filename, output_dir, fnfmt='slide{number:03d}.txt'):
+    """Export a plain-text outline of each slide of a .pptx file to output_dir.
+
+    Args:
+        filename: The .pptx file.
+        output_dir: Directory to write the text files to.
+        fnfmt: Filename format, with the slide `number` (1-based, in presentation order).
+
+    Returns:
+        List of the written filenames.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    with zipfile.ZipFile(filename, 'r') as zipfd:
+        presentation = 'ppt/presentation.xml'
+        rels = read_relationships(zipfd, presentation)
+        slides = []
+        with zipfd.open(presentation) as fd:
+            for event, elem in iterparse(fd):
+                if local_name(elem.tag) == 'sldId':
+                    reltype, partname = rels.get(_rel_id(elem), (None, None))
+                    slides.append(partname)
+        for number, partname in enumerate(slides, start=1):
+            if partname is None or partname not in zipfd.namelist():
+                continue
+            output_fn = os.path.join(output_dir, fnfmt.format(number=number))
+            with zipfd.open(partname) as fd, open(output_fn, 'w', encoding='utf-8') as out:
+                for line in iter_slide_outline(fd):
+                    out.write(line + '\n')
+            written.append(output_fn)
+    return written
+
+
+# filetype: exporter function
+TEXT_EXPORTERS = {
+    'xlsx': export_xlsx_text,
+    'pptx': export_pptx_text,
+}
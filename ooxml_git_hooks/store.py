@@ -12,28 +12,45 @@ Usage, ooxml-store=ooxml_git_hooks.store:cli entry point:
     # Store files to .ooxml_store/ directory:
     ooxml-store store-file <file>
     ooxml-store store-all
+    ooxml-store store-all --incremental
 
     # Recreate files stored in .ooxml_store/ directory:
     ooxml-store recreate-file <file>
     ooxml-store recreate-all
 
+    # List documents that are modified, new, missing, or stale compared to the store:
+    ooxml-store status
+
+    # Compare two stores and/or OOXML files at the part level:
+    ooxml-store diff <a> <b>
+
+    # Verify that all stores can be recreated, without writing anything to disk:
+    ooxml-store verify
+
+    # Remove stale stores of deleted or moved documents:
+    ooxml-store gc
+
 
 """
 
 # TODO: Opening .docx files with zipfile.ZipFile() sometimes fails if file is open in Word. Copy file before unzipping!
 
 import os
-import zipfile
-import shutil
-import yaml
-import pypandoc
+import sys
+import time
 import click
+# The hooks invoke the `ooxml-store` entry point many times per git operation, so heavier modules
+# (yaml, pypandoc, zipfile, shutil, concurrent.futures, etc.) are imported where they are first used.
 
-from ooxml_git_hooks.utils import get_filename_attrs, zip_directory, find_files, hash_file
+from ooxml_git_hooks.utils import (
+    get_filename_attrs, zip_directory, find_files, hash_file, zip_members, crc32_file, members_hexdigest, as_posix_path_str,
+    prettyprint_xml, XML_PART_SUFFIXES, write_directory_to_zip, NullWriter, git_index_hashes, GIT_HASH_METHODS,
+)
 
 
 # TODO: Read these from config file:
 FILE_METADATA_FN = "ooxml_metadata.yaml"
+MEMBERS_FN = "members.yaml"  # {arcname: {crc, size}} of the original archive, c.f. `utils.zip_members`.
 STORE_ROOT = '.ooxml_store'
 IGNORE = ('.ooxml_store/*', "**/~$*")
 INCLUDE = ('**/*.docx', '**/*.pptx', '**/*.xlsx')
@@ -42,11 +59,69 @@ INCLUDE = ('**/*.docx', '**/*.pptx', '**/*.xlsx')
 STORE_DIRFMT = '{filepath}.store/'
 # STORE_DIRFMT = '{filepath}/'
 PANDOC_FNFMT = '{fpnoext}.md'
+# Directory for the native text export of filetypes pandoc cannot read, c.f. `export.TEXT_EXPORTERS`:
+TEXT_DIRFMT = '{store_dir}/text/'
 INDEX_FN = 'index.yaml'
+# Any method supported by `utils.new_hasher`, e.g. 'md5', 'git-sha1', 'git-sha256', or 'blake2b-64'.
+# The method is recorded in each store's metadata, so stores created with different methods can be mixed.
 HASH_METHOD = 'md5'
+# Fixed member timestamp used when re-creating files, so the recreated archive only depends on the stored parts:
+RECREATE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
 DEFAULT_METADATA = {
     'archive': '.zip',
 }
+# (mode, ino, dev, nlink, uid, gid, size, atime, mtime, ctime)
+# Do not include atime, it is frequently updated (e.g. by search indexing).
+LSTAT_ATTRS = (
+    'st_size',  # size, in bytes
+    'st_ctime', 'st_ctime_ns',  # time of creation (Windows) or change (Unix)
+    'st_mtime', 'st_mtime_ns',  # time of modificaton.
+    'st_nlink', 'st_dev', 'st_ino',  # device, inode
+    'st_mode', 'st_uid', 'st_gid',  # filemode, user id, group id,
+    # 'st_flags', 'st_gen',  # user-defined flags, generation,
+)
+# The lstat attributes compared by `status`, similar to what git compares for its index entries.
+# Integer nanosecond timestamps are used; the float timestamps may not survive a yaml round-trip exactly.
+STATUS_LSTAT_ATTRS = ('st_size', 'st_mtime_ns', 'st_ctime_ns', 'st_ino', 'st_mode')
+STATUS_CATEGORIES = ('modified', 'new', 'missing', 'stale')
+# Local cache of the fast-path status data for all stores, c.f. `store_status`.
+# This file is specific to the local worktree (inode numbers etc.) and should be added to .gitignore.
+STATUS_CACHE_FN = 'status_cache.json'
+STATUS_CACHE_VERSION = 3
+# Only refresh the recorded lstat of files whose mtime is older than this (covers coarse filesystem timestamps):
+STATUS_RACY_NS = 3 * 10**9
+STATUS_CHUNKSIZE = 32
+# Fewer store entries are checked serially: Most entries only need an lstat, and importing and starting
+# the thread pool costs more than it saves for a typical (no-op) status.
+STATUS_PARALLEL_MIN = 4 * STATUS_CHUNKSIZE
+DIFF_CATEGORIES = ('added', 'removed', 'modified')
+
+
+
+def load_yaml(filename):
+    """Load a yaml file, using the libyaml-based loader when available (it is an order of magnitude faster)."""
+    import yaml
+    with open(filename) as fp:
+        return yaml.load(fp, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def dump_yaml(obj, filename):
+    import yaml
+    with open(filename, 'w') as fp:
+        yaml.dump(obj, fp, default_flow_style=False)
+
+
+def load_metadata(store_dir):
+    """Load the metadata dict for a single store directory."""
+    return load_yaml(os.path.join(store_dir, FILE_METADATA_FN))
+
+
+def load_members(store_dir):
+    """Load the recorded member CRCs/sizes for a single store directory, or None if not recorded."""
+    members_fn = os.path.join(store_dir, MEMBERS_FN)
+    if not os.path.isfile(members_fn):
+        return None
+    return load_yaml(members_fn)
 
 
 @click.group()
@@ -55,8 +130,11 @@ def cli():
 
 
 @click.command(name="store-all")
-def store_all_cli(basedir=".", **kwargs):
-    store_all(basedir, **kwargs)
+@click.option('--incremental', is_flag=True, default=False,
+              help="Only re-store changed files and garbage-collect stale stores, instead of a full rebuild.")
+@click.option('--hash-method', default=HASH_METHOD, help="Hash method, e.g. md5, git-sha1, git-sha256, blake2b-64.")
+def store_all_cli(basedir=".", incremental=False, **kwargs):
+    store_all(basedir, clean=not incremental, **kwargs)
 
 
 def store_all(
@@ -68,13 +146,17 @@ def store_all(
         pandoc_fnfmt=PANDOC_FNFMT,
         # configfn=None,
         clean=True,
+        hash_method=HASH_METHOD,
         verbose=2,
 ):
-    """"""
-    # TODO: Option to only process changed files.
-    # For instance,
-    # Q: How does git determine which files have changed? A: It records `lstat` information.
-
+    """Store all files matching `include` patterns.
+
+    If `clean` is False, the store is updated incrementally: Only files whose content has changed
+    (c.f. `check_cache_entry`) are re-stored, and stale store directories are removed with `gc_store`.
+    Files that are only 'stale' (e.g. after `recreate-all` or a checkout) are not re-stored;
+    their refreshed lstat is saved in the status cache instead.
+    """
+    import shutil
     if verbose and verbose > 1:
         print("\nCreating store...")
 
@@ -90,32 +172,60 @@ def store_all(
     if verbose and verbose > 1:
         print(" - Adding files to store:", input_files)
 
+    cache = {} if clean else load_status_cache(store_root)
+    cache_changed = False
     for filepath in input_files:
         if os.path.basename(filepath).startswith("~$"):
             print("SKIPPING FILE: %r" % (filepath,))
             continue
-        store_file(filepath, store_root=store_root, store_dirfmt=store_dirfmt)
+        if not clean:
+            store_dir = os.path.join(store_root, store_dirfmt).format(
+                store_root=store_root, **get_filename_attrs(filepath))
+            if os.path.isfile(os.path.join(store_dir, FILE_METADATA_FN)):
+                try:
+                    status, entry = check_cache_entry(cached_status_entry(store_dir, cache))
+                except Exception as exc:
+                    print(" - Could not read store %r, re-storing: %s: %s" % (store_dir, type(exc).__name__, exc))
+                else:
+                    if status in (None, 'stale'):
+                        cache_changed |= cache.get(os.path.normpath(store_dir)) != entry
+                        cache[os.path.normpath(store_dir)] = entry
+                        continue
+            if os.path.isdir(store_dir):
+                shutil.rmtree(store_dir)
+        store_file(filepath, store_root=store_root, store_dirfmt=store_dirfmt, add_hash=hash_method)
+
+    if not clean:
+        if cache_changed:
+            save_status_cache(cache, store_root)
+        gc_store(store_root=store_root, store_dirfmt=store_dirfmt, verbose=verbose)
 
 
 @click.command(name="store-file")
 @click.argument('filename', type=click.Path(exists=True))
+@click.option('--hash-method', default=HASH_METHOD, help="Hash method, e.g. md5, git-sha1, git-sha256, blake2b-64.")
 def store_file_cli(
         filename,
         store_root=STORE_ROOT, store_dirfmt=STORE_DIRFMT,
         pandoc_fnfmt=None,
+        hash_method=HASH_METHOD,
         verbose=2
 ):
-    store_file(filename, store_root=store_root, store_dirfmt=store_dirfmt, pandoc_fnfmt=pandoc_fnfmt, verbose=verbose)
+    store_file(
+        filename, store_root=store_root, store_dirfmt=store_dirfmt, pandoc_fnfmt=pandoc_fnfmt,
+        add_hash=hash_method, verbose=verbose)
 
 
 def store_file(
         filename,
         store_root=STORE_ROOT, store_dirfmt=STORE_DIRFMT,
         pandoc_fnfmt="{store_dir}/{stem}.md",
-        add_lstat=True, add_hash='md5',
+        add_lstat=True, add_hash=HASH_METHOD,
+        text_dirfmt=TEXT_DIRFMT,
         verbose=2
 ):
 
+    import zipfile
     inputfn_attrs = get_filename_attrs(filename)
 
     store_dir = os.path.join(store_root, store_dirfmt).format(store_root=store_root, **inputfn_attrs)
@@ -132,36 +242,49 @@ def store_file(
         if add_hash is True:
             add_hash = HASH_METHOD
         config['hash_method'] = add_hash
-        config['hash_hexdigest'] = hash_file(filename)
+        config['hash_hexdigest'] = hash_file(filename, method=add_hash)
 
     if add_lstat:
-        # (mode, ino, dev, nlink, uid, gid, size, atime, mtime, ctime)
-        # Do not include atime, it is frequently updated (e.g. by search indexing).
         lstat = os.lstat(filename)
-        stat_attrs = (
-            'st_size',  # size, in bytes
-            'st_ctime', 'st_ctime_ns',  # time of creation (Windows) or change (Unix)
-            'st_mtime', 'st_mtime_ns',  # time of modificaton.
-            'st_nlink', 'st_dev', 'st_ino',  # device, inode
-            'st_mode', 'st_uid', 'st_gid',  # filemode, user id, group id,
-            # 'st_flags', 'st_gen',  # user-defined flags, generation,
-        )
-        config['lstat'] = {a: getattr(lstat, a, 0) for a in stat_attrs}  # list(lstat)
+        config['lstat'] = {a: getattr(lstat, a, 0) for a in LSTAT_ATTRS}  # list(lstat)
 
     try:
         with zipfile.ZipFile(filename, 'r') as zipfd:
             zipfd.extractall(archive_dir)
+            members = zip_members(zipfd)
     except zipfile.BadZipfile:
         import tempfile
+        import shutil
         with tempfile.TemporaryDirectory() as tempdir:
             tempfn = os.path.join(tempdir, inputfn_attrs['name'])
             print("Copying %r -> %r" % (filename, tempfn))
             shutil.copyfile(filename, tempfn)
             with zipfile.ZipFile(tempfn, 'r') as zipfd:
                 zipfd.extractall(archive_dir)
-
-    if pandoc_fnfmt:
-        pandoc_supported_formats = pypandoc.get_pandoc_formats()  # from, to
+                members = zip_members(zipfd)
+    # Record the central-directory CRCs, so stores can be compared/verified without reading the parts.
+    # These are kept out of the metadata file, which is read much more often (status, gc, store-all).
+    dump_yaml(members, os.path.join(store_dir, MEMBERS_FN))
+    if add_hash:
+        # The original file can generally not be reproduced byte-for-byte (member order, timestamps, compression),
+        # so also record a hash of the member CRCs, which a file re-created from the store reproduces:
+        config['members_hash_hexdigest'] = members_hexdigest(members, method=add_hash)
+
+    from ooxml_git_hooks.export import TEXT_EXPORTERS
+    exporter = TEXT_EXPORTERS.get(inputfn_attrs['filetype'])
+    if exporter and text_dirfmt:
+        # Pandoc cannot read xlsx/pptx; export these in-process instead of spawning pandoc.
+        text_dir = text_dirfmt.format(store_root=store_root, store_dir=store_dir, **inputfn_attrs)
+        if verbose and verbose > 1:
+            print(" - Exporting text: %r -> %r" % (filename, text_dir))
+        try:
+            exporter(filename, text_dir)
+        except Exception as exc:
+            # Like the pandoc stage, a failed text export should not prevent the file from being stored:
+            print(" - Could not export text: %s: %s" % (type(exc).__name__, exc))
+    elif pandoc_fnfmt:
+        import pypandoc
+        # pandoc_supported_formats = pypandoc.get_pandoc_formats()  # from, to  (spawns pandoc, currently unused)
         if isinstance(pandoc_fnfmt, str):
             pandoc_fnfmt = [pandoc_fnfmt]
         for output_fnfmt in pandoc_fnfmt:
@@ -181,8 +304,7 @@ def store_file(
                 print(" - Could not convert with pandoc: %s" % (exc,))
     metadata_fn = os.path.join(store_dir, FILE_METADATA_FN)
 
-    with open(metadata_fn, 'w') as fp:
-        yaml.dump(config, fp, default_flow_style=False)
+    dump_yaml(config, metadata_fn)
 
 
 @click.command(name="recreate-file")
@@ -203,7 +325,7 @@ def recreate_stored_file(
     metadata_fn = os.path.join(store_dir, FILE_METADATA_FN)
     if verbose and verbose > 1:
         print("\n - Reading metadata:", metadata_fn)
-    config = yaml.load(open(metadata_fn))
+    config = load_metadata(store_dir)
 
     if target_fn is None:
         target_fn = config['inputfn']
@@ -218,24 +340,11 @@ def recreate_stored_file(
 
     if verbose and verbose > 1:
         print(" - Creating ooxml/zipfile %r from store archive %r..." % (target_fn, archive_dir))
-    zip_directory(directory=archive_dir, overwrite=overwrite, targetfn=target_fn)
-
-
-@click.command(name="recreate-all")
-@click.option('--overwrite', is_flag=True, default=None)
-@click.option('--use-index', is_flag=True, default=None)
-def recreate_all_cli(store_root=STORE_ROOT, use_index=None, overwrite=None, verbose=2):
-    recreate_all(store_root=store_root, use_index=use_index, overwrite=overwrite, verbose=verbose)
-
+    zip_directory(directory=archive_dir, overwrite=overwrite, targetfn=target_fn, date_time=RECREATE_DATE_TIME)
 
-def recreate_all(
-        store_root=STORE_ROOT, use_index=None, overwrite=None, verbose=2
-):
-    """"""
-    # TODO: Only re-create changed files.
 
-    if verbose and verbose > 0:
-        print("\nRe-creating all files in store_root %r" % (store_root,))
+def find_store_dirs(store_root=STORE_ROOT, use_index=None, verbose=2):
+    """Return a list of all store directories in `store_root`, either from the index or by walking the store."""
     index_fn = os.path.join(store_root, INDEX_FN)
     if use_index is None:
         use_index = os.path.isfile(index_fn)
@@ -243,7 +352,7 @@ def recreate_all(
     if use_index:
         if verbose and verbose > 0:
             print(" - Reading index: %r" % (index_fn,))
-        index = yaml.load(open(index_fn))
+        index = load_yaml(index_fn)
         if isinstance(index, dict):
             # inputfn: store_dir,  but we only need the store_dir
             store_dirs = index.values()
@@ -251,23 +360,573 @@ def recreate_all(
             # just a list of store_dirs
             store_dirs = index
     else:
-        glob_pat = os.path.join(store_root, "**", FILE_METADATA_FN)
-        print("Metadata glob_pat:", glob_pat)
-        metadata_files = find_files(
-            rootdir=store_root, glob_pats=glob_pat, unix_globbing=True)
+        # Walk the store tree, but do not descend into store directories (they do not nest),
+        # which avoids listing all the extracted archive parts:
+        store_dirs = []
+        for dirpath, dirnames, filenames in os.walk(store_root):
+            if FILE_METADATA_FN in filenames:
+                store_dirs.append(dirpath)
+                dirnames[:] = []
+            else:
+                dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
         if verbose and verbose > 0:
-            print(" - %s store metadata files located" % (len(metadata_files),))
-        store_dirs = [os.path.dirname(metadata_fn) for metadata_fn in metadata_files]
-        assert all(os.path.isdir(d) for d in store_dirs)
+            print(" - %s store metadata files located" % (len(store_dirs),))
+
+    return list(store_dirs)
+
+
+@click.command(name="gc")
+@click.option('--dry-run', is_flag=True, default=False, help="Only list the store directories that would be removed.")
+def gc_cli(store_root=STORE_ROOT, store_dirfmt=STORE_DIRFMT, dry_run=False, verbose=2):
+    gc_store(store_root=store_root, store_dirfmt=store_dirfmt, dry_run=dry_run, verbose=verbose)
+
+
+def gc_store(store_root=STORE_ROOT, store_dirfmt=STORE_DIRFMT, dry_run=False, verbose=2):
+    """Remove stale store directories, instead of rebuilding the whole store.
+
+    A store directory is stale if its `inputfn` no longer exists,
+    or if its location no longer matches `store_dirfmt` for its `inputfn`.
+    Store directories whose metadata cannot be read are reported and skipped.
+    Empty directories left in `store_root`, and index and status-cache entries for removed stores are pruned as well.
+
+    Returns:
+        List of removed store directories.
+    """
+    if not os.path.isdir(store_root):
+        return []
+    # Always glob: The index may not list every store directory on disk.
+    store_dirs = find_store_dirs(store_root=store_root, use_index=False, verbose=0)
+    stale = []
+    for store_dir in store_dirs:
+        try:
+            inputfn = load_metadata(store_dir)['inputfn']
+        except Exception as exc:
+            print("Skipping store %r, could not read its metadata: %s: %s" % (store_dir, type(exc).__name__, exc))
+            continue
+        expected_dir = os.path.join(store_root, store_dirfmt).format(
+            store_root=store_root, **get_filename_attrs(inputfn))
+        if not os.path.isfile(inputfn):
+            reason = "input file %r no longer exists" % (inputfn,)
+        elif os.path.normpath(expected_dir) != os.path.normpath(store_dir):
+            reason = "store dir does not match %r" % (store_dirfmt,)
+        else:
+            continue
+        if verbose and verbose > 0:
+            print("%s stale store %r: %s" % ("Would remove" if dry_run else "Removing", store_dir, reason))
+        stale.append(store_dir)
+
+    if dry_run:
+        return stale
+
+    import shutil
+    for store_dir in stale:
+        shutil.rmtree(store_dir)
+        # Prune parent directories left empty, up to (but not including) store_root:
+        parent = os.path.dirname(os.path.normpath(store_dir))
+        while parent and os.path.normpath(parent) != os.path.normpath(store_root) and not os.listdir(parent):
+            os.rmdir(parent)
+            parent = os.path.dirname(parent)
+
+    index_fn = os.path.join(store_root, INDEX_FN)
+    if stale and os.path.isfile(index_fn):
+        removed = {os.path.normpath(store_dir) for store_dir in stale}
+        index = load_yaml(index_fn)
+        if isinstance(index, dict):
+            index = {k: v for k, v in index.items() if os.path.normpath(v) not in removed}
+        else:
+            index = [v for v in index if os.path.normpath(v) not in removed]
+        dump_yaml(index, index_fn)
+
+    # Also prune cache entries of store directories removed by other means:
+    cache = load_status_cache(store_root)
+    existing = {os.path.normpath(store_dir) for store_dir in store_dirs} - {os.path.normpath(d) for d in stale}
+    pruned = {k: v for k, v in cache.items() if os.path.normpath(k) in existing}
+    if pruned != cache:
+        save_status_cache(pruned, store_root)
+
+    return stale
+
+
+@click.command(name="recreate-all")
+@click.option('--overwrite', is_flag=True, default=None)
+@click.option('--use-index', is_flag=True, default=None)
+def recreate_all_cli(store_root=STORE_ROOT, use_index=None, overwrite=None, verbose=2):
+    recreate_all(store_root=store_root, use_index=use_index, overwrite=overwrite, verbose=verbose)
+
+
+def recreate_all(
+        store_root=STORE_ROOT, use_index=None, overwrite=None, verbose=2
+):
+    """"""
+    # TODO: Only re-create changed files.
+
+    if verbose and verbose > 0:
+        print("\nRe-creating all files in store_root %r" % (store_root,))
+    store_dirs = find_store_dirs(store_root=store_root, use_index=use_index, verbose=verbose)
 
     for store_dir in store_dirs:
         recreate_stored_file(store_dir, overwrite=overwrite)
 
+
+def build_recreated_archive(archive_dir, target, compress_type=None):
+    """Write the archive that `recreate_stored_file` creates to a file object. Returns the member CRCs/sizes."""
+    import zipfile
+    with zipfile.ZipFile(target, mode="w") as zipfd:
+        write_directory_to_zip(
+            zipfd, archive_dir, compress_type=compress_type, date_time=RECREATE_DATE_TIME, verbose=0)
+        return zip_members(zipfd)
+
+
+def verify_stored_file(store_dir, check_hash=False):
+    """Verify that recreating a stored file reproduces the members recorded at store time.
+
+    The archive that `recreate_stored_file` would create is built without writing anything to disk,
+    and the CRC/size of each member is compared against the values recorded by `store_file`.
+
+    Args:
+        store_dir: The store directory to verify.
+        check_hash: Also compare the hash of the recreated members (c.f. `utils.members_hexdigest`)
+            against the members hash recorded in the metadata at store time.
+
+    Returns:
+        List of (name, reason) tuples, one for each problem found. An empty list means the store verified OK.
+    """
+    import zipfile
+    config = load_metadata(store_dir)
+    archive_dir = os.path.join(store_dir, config['archive'])
+    recorded = load_members(store_dir)
+    if recorded is None:
+        return [(None, "no member CRCs recorded (%s is missing)" % (MEMBERS_FN,))]
+
+    # Member CRCs are calculated from the uncompressed data, so skip compression:
+    members = build_recreated_archive(archive_dir, NullWriter(), compress_type=zipfile.ZIP_STORED)
+
+    problems = [(name, "missing") for name in sorted(set(recorded) - set(members))]
+    problems += [(name, "unexpected") for name in sorted(set(members) - set(recorded))]
+    for name in sorted(set(recorded) & set(members)):
+        if members[name]['size'] != recorded[name]['size']:
+            problems.append((name, "size %s != %s" % (members[name]['size'], recorded[name]['size'])))
+        elif members[name]['crc'] != recorded[name]['crc']:
+            problems.append((name, "crc %08x != %08x" % (members[name]['crc'], recorded[name]['crc'])))
+
+    if check_hash:
+        hash_method = config.get('hash_method', HASH_METHOD)
+        if 'members_hash_hexdigest' not in config:
+            problems.append((None, "no members hash recorded in metadata"))
+        elif members_hexdigest(members, method=hash_method) != config['members_hash_hexdigest']:
+            problems.append((None, "%s members hash differs" % (hash_method,)))
+    return problems
+
+
+@click.command(name="verify")
+@click.argument('store_dirs', nargs=-1, type=click.Path(exists=True))
+@click.option('--hash', 'check_hash', is_flag=True, default=False, help="Also compare the recorded members hash.")
+@click.option('--use-index', is_flag=True, default=None)
+@click.option('--jobs', '-j', type=int, default=None, help="Number of parallel workers.")
+def verify_cli(store_dirs, check_hash=False, use_index=None, jobs=None, store_root=STORE_ROOT):
+    results = verify_all(
+        store_root=store_root, store_dirs=store_dirs or None,
+        check_hash=check_hash, use_index=use_index, jobs=jobs)
+    failed = 0
+    for store_dir, problems in results.items():
+        if problems:
+            failed += 1
+            print("FAILED: %s" % (store_dir,))
+            for name, reason in problems:
+                print(" - %s: %s" % (name, reason) if name else " - %s" % (reason,))
+    print("%s of %s stores verified OK." % (len(results) - failed, len(results)))
+    if failed:
+        sys.exit(1)
+
+
+def verify_all(store_root=STORE_ROOT, store_dirs=None, check_hash=False, use_index=None, jobs=None):
+    """Verify all store directories in parallel, c.f. `verify_stored_file`.
+
+    Returns:
+        dict with {store_dir: problems} for each store directory.
+    """
+    if store_dirs is None:
+        store_dirs = find_store_dirs(store_root=store_root, use_index=use_index, verbose=0)
+
+    def verify(store_dir):
+        # A single broken store should be reported, not abort the whole run:
+        try:
+            return verify_stored_file(store_dir, check_hash=check_hash)
+        except Exception as exc:
+            return [(None, "%s: %s" % (type(exc).__name__, exc))]
+
+    from concurrent.futures import ThreadPoolExecutor
+    # zlib releases the GIL while calculating CRCs and compressing, so threads are sufficient:
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(verify, store_dirs)
+        return dict(zip(store_dirs, results))
+
+
+def status_cache_entry(store_dir, lstat_attrs=STATUS_LSTAT_ATTRS):
+    """Create the status-cache entry for a store directory from its (yaml) metadata file."""
+    metadata_mtime_ns = os.stat(os.path.join(store_dir, FILE_METADATA_FN)).st_mtime_ns
+    config = load_metadata(store_dir)
+    recorded = config.get('lstat')
+    entry = {
+        'inputfn': config['inputfn'],
+        'metadata_mtime_ns': metadata_mtime_ns,
+        # The lstat was recorded just before the metadata file was written:
+        'lstat_recorded_ns': metadata_mtime_ns,
+        'lstat': {a: recorded.get(a) for a in lstat_attrs} if recorded else None,
+    }
+    if 'hash_hexdigest' in config:
+        entry['hash_method'] = config.get('hash_method', HASH_METHOD)
+        entry['hash_hexdigest'] = config['hash_hexdigest']
+        if 'members_hash_hexdigest' in config:
+            # A file re-created from the store is also in sync with the store, c.f. `check_cache_entry`:
+            entry['members_hash_hexdigest'] = config['members_hash_hexdigest']
+    return entry
+
+
+def load_status_cache(store_root=STORE_ROOT):
+    """Load the status cache, {normpath(store_dir): entry}, c.f. `status_cache_entry`. Returns an empty dict if missing."""
+    import json
+    try:
+        with open(os.path.join(store_root, STATUS_CACHE_FN)) as fp:
+            cache = json.load(fp)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('version') != STATUS_CACHE_VERSION:
+        return {}
+    return cache['entries']
+
+
+def save_status_cache(entries, store_root=STORE_ROOT):
+    """Write the status cache atomically. Returns False if the cache could not be written.
+
+    Concurrent writers each use their own temporary file; the last one to finish wins.
+    The cache is only an optimization, so failing to write it is not an error.
+    """
+    import json
+    import tempfile
+    cache_fn = os.path.join(store_root, STATUS_CACHE_FN)
+    tmp_fn = None
+    try:
+        fd, tmp_fn = tempfile.mkstemp(dir=store_root, prefix=STATUS_CACHE_FN + ".", suffix=".tmp")
+        with open(fd, 'w') as fp:
+            json.dump({'version': STATUS_CACHE_VERSION, 'entries': entries}, fp, separators=(',', ':'))
+        os.replace(tmp_fn, cache_fn)
+    except OSError as exc:
+        print("Could not write status cache %r: %s" % (cache_fn, exc), file=sys.stderr)
+        if tmp_fn is not None:
+            try:
+                os.remove(tmp_fn)
+            except OSError:
+                pass
+        return False
+    return True
+
+
+def check_cache_entry(entry, lstat_attrs=STATUS_LSTAT_ATTRS, git_hashes=None):
+    """Compare a status-cache entry against the current worktree file.
+
+    The worktree file is only hashed if its lstat differs from the recorded lstat,
+    or if the entry is "racy", i.e. the file was modified in the same timestamp-granularity window
+    as the lstat was recorded. This is the same approach git uses for its index,
+    c.f. Documentation/technical/racy-git.txt.
+
+    If the content hash matches but the lstat differs, the entry's lstat is refreshed (like git refreshes its index),
+    so the file is not hashed again on the next call. The lstat is only refreshed when the file's mtime is
+    at least `STATUS_RACY_NS` old, so a refreshed entry can never be racily clean.
+
+    A file whose content hash differs is still in sync if its member CRCs match the store,
+    e.g. a file re-created from the store, c.f. `zip_members_match`.
+
+    Args:
+        entry: Status-cache entry, c.f. `status_cache_entry`.
+        lstat_attrs: The lstat attributes to compare.
+        git_hashes: Optional {normpath: blob_id} dict of files unmodified in the git index, c.f. `git_index_hashes`.
+            Used instead of reading the file for stores recorded with a git hash method,
+            if the blob id matches the recorded hash; otherwise the file is hashed.
+
+    Returns:
+        (status, entry) tuple, where status is one of 'modified', 'missing', 'stale', or None if unchanged,
+        and entry is the (possibly refreshed) cache entry.
+        'stale' means that the file content is unchanged, but the recorded lstat info was outdated.
+    """
+    inputfn = entry['inputfn']
+    try:
+        lstat = os.lstat(inputfn)
+    except FileNotFoundError:
+        return 'missing', entry
+
+    recorded = entry['lstat']
+    if recorded:
+        lstat_changed = any(recorded.get(a) != getattr(lstat, a, 0) for a in lstat_attrs)
+        if not lstat_changed:
+            if lstat.st_mtime_ns < entry['lstat_recorded_ns']:
+                return None, entry
+            # Racily clean: The file may have been modified after its lstat was recorded
+            # without the timestamp changing. Fall through and compare the content hash.
+    else:
+        lstat_changed = True
+
+    if 'hash_hexdigest' not in entry:
+        return ('modified' if lstat_changed else None), entry
+    hash_method = entry['hash_method']
+    hexdigest = None
+    if git_hashes and hash_method in GIT_HASH_METHODS:
+        hexdigest = git_hashes.get(os.path.normpath(inputfn))
+        if hexdigest != entry['hash_hexdigest']:
+            # The index blob is the *filtered* content (clean filters, eol conversion, LFS pointers),
+            # or the repository uses a different object format, so only a matching blob id is conclusive.
+            hexdigest = None
+    if hexdigest is None:
+        hexdigest = hash_file(inputfn, method=hash_method)
+    if hexdigest != entry['hash_hexdigest'] and not zip_members_match(inputfn, entry):
+        return 'modified', entry
+
+    now_ns = int(time.time() * 10**9)  # time.time_ns() requires Python 3.7
+    if lstat.st_mtime_ns + STATUS_RACY_NS < now_ns:
+        entry = dict(entry, lstat={a: getattr(lstat, a, 0) for a in lstat_attrs}, lstat_recorded_ns=now_ns)
+    return ('stale' if lstat_changed else None), entry
+
+
+def zip_members_match(inputfn, entry):
+    """Return True if the member CRCs in the zip central directory of inputfn match the entry's members hash.
+
+    A file re-created from the store has different bytes than the original file, but the same members.
+    """
+    import zipfile
+    if 'members_hash_hexdigest' not in entry:
+        return False
+    try:
+        with zipfile.ZipFile(inputfn, 'r') as zipfd:
+            members = zip_members(zipfd)
+    except (OSError, zipfile.BadZipfile):
+        return False
+    return members_hexdigest(members, method=entry['hash_method']) == entry['members_hash_hexdigest']
+
+
+def cached_status_entry(store_dir, cache):
+    """Return the status-cache entry for a store directory, only reading its yaml metadata if it has changed.
+
+    Args:
+        store_dir: The store directory.
+        cache: The status cache, {normpath(store_dir): entry}, c.f. `load_status_cache`.
+    """
+    entry = cache.get(os.path.normpath(store_dir))
+    metadata_mtime_ns = os.stat(os.path.join(store_dir, FILE_METADATA_FN)).st_mtime_ns
+    if entry is None or entry['metadata_mtime_ns'] != metadata_mtime_ns:
+        entry = status_cache_entry(store_dir)
+    return entry
+
+
+@click.command(name="status")
+@click.option('--use-index', is_flag=True, default=None)
+@click.option('--jobs', '-j', type=int, default=None, help="Number of parallel workers.")
+@click.option('--use-git-index', is_flag=True, default=False,
+              help="Use blob ids from the git index instead of hashing files (for git-sha1/git-sha256 stores).")
+def status_cli(basedir=".", store_root=STORE_ROOT, use_index=None, jobs=None, use_git_index=False):
+    result = store_status(
+        basedir=basedir, store_root=store_root, use_index=use_index, jobs=jobs, use_git_index=use_git_index)
+    for category in STATUS_CATEGORIES:
+        for inputfn in result[category]:
+            print("%-10s %s" % (category + ":", inputfn))
+
+
+def store_status(
+        basedir=".",
+        include=INCLUDE,
+        ignore=IGNORE,
+        store_root=STORE_ROOT,
+        store_dirfmt=STORE_DIRFMT,
+        use_index=None,
+        jobs=None,
+        use_git_index=False,
+):
+    """Determine which documents are out of sync with their store.
+
+    Args:
+        basedir: The worktree directory to search for new documents.
+        include: Glob patterns for the documents to include.
+        ignore: Glob patterns for the files to ignore.
+        store_root: The store root directory.
+        store_dirfmt: Format string for the store directory of each document (used to detect new documents).
+        use_index: Read store directories from the index file. Default is to use the index if present.
+        jobs: Number of parallel workers used to check the store entries.
+        use_git_index: Compare against the blob ids in the git index for files that git considers unmodified,
+            instead of reading the files. Only applies to stores recorded with a git hash method.
+            Files whose blob id differs from the recorded hash (e.g. due to clean filters) are still hashed.
+
+    Returns:
+        dict with a sorted list of filenames for each category in `STATUS_CATEGORIES`.
+    """
+    result = {category: [] for category in STATUS_CATEGORIES}
+    if os.path.isdir(store_root):
+        store_dirs = find_store_dirs(store_root=store_root, use_index=use_index, verbose=0)
+    else:
+        store_dirs = []
+
+    git_hashes = None
+    if use_git_index:
+        git_hashes = {
+            os.path.normpath(os.path.join(basedir, path)): blob_id
+            for path, blob_id in git_index_hashes(cwd=basedir).items()
+        }
+
+    # The status cache holds the fast-path data for all stores in a single file, like git's index,
+    # so the per-store yaml metadata is only parsed when it has changed since the cache was written.
+    cache = load_status_cache(store_root) if store_dirs else {}
+
+    def check(store_dir):
+        return check_cache_entry(cached_status_entry(store_dir, cache), git_hashes=git_hashes)
+
+    if jobs == 1 or (jobs is None and len(store_dirs) < STATUS_PARALLEL_MIN) or len(store_dirs) < 2:
+        results = list(map(check, store_dirs))
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        # lstat and hashing are I/O bound and release the GIL, so threads are sufficient.
+        # Entries are submitted in chunks; most entries only need an lstat, which is cheaper than a submit.
+        chunks = [store_dirs[i:i + STATUS_CHUNKSIZE] for i in range(0, len(store_dirs), STATUS_CHUNKSIZE)]
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            results = [
+                checked for chunk_results in executor.map(lambda chunk: [check(d) for d in chunk], chunks)
+                for checked in chunk_results
+            ]
+
+    new_cache = {}
+    stored = set()
+    for store_dir, (status, entry) in zip(store_dirs, results):
+        new_cache[os.path.normpath(store_dir)] = entry
+        stored.add(os.path.normpath(entry['inputfn']))
+        if status:
+            result[status].append(entry['inputfn'])
+    if new_cache != cache:
+        save_status_cache(new_cache, store_root)
+
+    for filepath in find_files(rootdir=basedir, glob_pats=include, excludes=ignore):
+        if os.path.basename(filepath).startswith("~$") or os.path.normpath(filepath) in stored:
+            continue
+        store_dir = os.path.join(store_root, store_dirfmt).format(store_root=store_root, **get_filename_attrs(filepath))
+        if not os.path.isfile(os.path.join(store_dir, FILE_METADATA_FN)):
+            result['new'].append(filepath)
+
+    for filenames in result.values():
+        filenames.sort()
+    return result
+
+
+class PartSource:
+    """Read-only access to the parts of either a store directory or an OOXML (zip) file.
+
+    Member CRCs are read from the store's members file or the zip central directory,
+    so no parts are decompressed or read until `read` is called.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.zipfd = None
+        self.config = None
+        if os.path.isdir(path):
+            self.config = load_metadata(path)
+            self.archive_dir = os.path.join(path, self.config['archive'])
+            self.members = load_members(path) or self._scan_archive_dir()
+        else:
+            import zipfile
+            self.zipfd = zipfile.ZipFile(path, 'r')
+            self.members = zip_members(self.zipfd)
+
+    def _scan_archive_dir(self):
+        # Fallback for stores created before member CRCs were recorded in members.yaml (`MEMBERS_FN`):
+        members = {}
+        for dirpath, dirnames, filenames in os.walk(self.archive_dir):
+            for fname in filenames:
+                fpath = os.path.join(dirpath, fname)
+                arcname = as_posix_path_str(os.path.relpath(fpath, start=self.archive_dir))
+                members[arcname] = {'crc': crc32_file(fpath), 'size': os.path.getsize(fpath)}
+        return members
+
+    def read(self, name):
+        if self.zipfd is not None:
+            return self.zipfd.read(name)
+        with open(os.path.join(self.archive_dir, name), 'rb') as fd:
+            return fd.read()
+
+    def close(self):
+        if self.zipfd is not None:
+            self.zipfd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def diff_parts(a, b):
+    """Compare two store directories and/or OOXML files at the part level using member CRCs.
+
+    Args:
+        a, b: Store directory or OOXML filename.
+
+    Returns:
+        dict with a sorted list of part names for each category in `DIFF_CATEGORIES`.
+    """
+    with PartSource(a) as source_a, PartSource(b) as source_b:
+        return _diff_members(source_a, source_b)
+
+
+def _diff_members(source_a, source_b):
+    members_a, members_b = source_a.members, source_b.members
+    result = {category: [] for category in DIFF_CATEGORIES}
+    if (source_a.config and source_b.config
+            and source_a.config.get('hash_method') == source_b.config.get('hash_method')
+            and source_a.config.get('hash_hexdigest')
+            and source_a.config.get('hash_hexdigest') == source_b.config.get('hash_hexdigest')):
+        # Both stores were created from identical files.
+        return result
+    result['added'] = sorted(set(members_b) - set(members_a))
+    result['removed'] = sorted(set(members_a) - set(members_b))
+    result['modified'] = sorted(
+        name for name in set(members_a) & set(members_b)
+        if (members_a[name]['crc'], members_a[name]['size']) != (members_b[name]['crc'], members_b[name]['size'])
+    )
+    return result
+
+
+def diff_part_text(source_a, source_b, name, method=None, context=3):
+    """Return a unified diff (list of lines) of the prettified XML of a single part in two sources."""
+    import difflib
+
+    def pretty_lines(source):
+        return prettyprint_xml(source.read(name), method=method).splitlines(keepends=True)
+    return list(difflib.unified_diff(
+        pretty_lines(source_a), pretty_lines(source_b),
+        fromfile="a/" + name, tofile="b/" + name, n=context,
+    ))
+
+
+@click.command(name="diff")
+@click.argument('a', type=click.Path(exists=True))
+@click.argument('b', type=click.Path(exists=True))
+@click.option('--xml', 'show_xml', is_flag=True, default=False, help="Show prettified XML diff of modified parts.")
+@click.option('--method', default=None, help="XML prettify method.")
+def diff_cli(a, b, show_xml=False, method=None):
+    with PartSource(a) as source_a, PartSource(b) as source_b:
+        result = _diff_members(source_a, source_b)
+        for category in DIFF_CATEGORIES:
+            for name in result[category]:
+                print("%s %s" % (category[0].upper(), name))
+        if show_xml:
+            for name in result['modified']:
+                if name.endswith(XML_PART_SUFFIXES):
+                    print("".join(diff_part_text(source_a, source_b, name, method=method)), end="")
+
 # Add click commands to the click `cli` group:
 cli.add_command(store_all_cli, name="store-all")
 cli.add_command(store_file_cli, name="store-file")
 cli.add_command(recreate_file_cli, name="recreate-file")
 # cli.add_command(recreate_stored_file)
 cli.add_command(recreate_all_cli, name="recreate-all")
+cli.add_command(status_cli, name="status")
+cli.add_command(diff_cli, name="diff")
+cli.add_command(verify_cli, name="verify")
+cli.add_command(gc_cli, name="gc")
 
 
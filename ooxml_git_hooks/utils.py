@@ -3,11 +3,9 @@
 import sys
 import os
 import re
-import pathlib
 import fnmatch
 import glob
-import zipfile
-import hashlib
+import zlib
 
 
 IGNORE = [
@@ -31,6 +29,10 @@ DIRECTORIES = [
 # * dirpath     ./path/to
 
 
+# Filename suffixes of the XML parts in OOXML packages:
+XML_PART_SUFFIXES = ('.xml', '.rels', '.vml')
+
+
 DEFAULT_CONVERSION = {
     'include': ('**/*.docx', '**/*.pptx', '**/*.xlsx'),
     'ignore': '.ooxml_store/*',
@@ -121,6 +123,7 @@ def regex_from_pathfmt(pathfmt, fnchars="[^//]", do_test=True):
 
 def test_path_regex(path_regex, pathfmt, testset=None):
     """Assert that path_regex properly captures the variables of pathfmt."""
+    import pathlib
     if testset is None:
         testset = [
             dict(inputfn='path/to/file.docx', glob_pat='**/*.docx'),
@@ -157,6 +160,7 @@ def get_filename_attrs(filepath):
     #  * https://groups.google.com/d/msg/python-ideas/f4fZfY1HLJs/2FSCObPdTKEJ
     #
 
+    import pathlib
     p = pathlib.Path(filepath)
     return dict(
         filepath=filepath, path=filepath,
@@ -170,6 +174,7 @@ def get_filename_attrs(filepath):
 
 def as_posix_path_str(path):
     """Ensure that a filepath str that has forward slashes regardless of platform."""
+    import pathlib
     return pathlib.PurePath(path).as_posix()
 
 pp = as_posix_path_str  # alias
@@ -179,7 +184,7 @@ pp = as_posix_path_str  # alias
 def zip_directory(
         directory, targetfn=None, relative=True,
         overwrite=None,
-        compress_type=zipfile.ZIP_DEFLATED, verbose=1
+        compress_type=None, date_time=None, verbose=1
 ):
     """Zip all files and folders in a directory.
 
@@ -187,17 +192,18 @@ def zip_directory(
         directory: The directory whose contents should be zipped.
         targetfn: Output filename of the zipped archive.
         relative: If True, make the arcname relative to the input directory.
-        compress_type: Which kind of compression to use. See zipfile package.
+        compress_type: Which kind of compression to use. See zipfile package. Default is ZIP_DEFLATED.
+        date_time: Fixed timestamp for all members, c.f. `write_directory_to_zip`.
         verbose: How much information to print to stdout while creating the archive.
 
     Returns:
         The filename of the zipped archive.
 
     """
+    import zipfile
     assert os.path.isdir(directory)
     if targetfn is None:
         targetfn = directory + ".zip"
-    filecount = 0
     if verbose and verbose > 0:
         print("Creating archive %r from directory %r:" % (targetfn, directory))
 
@@ -211,44 +217,116 @@ If you want to keep the old file, please move/rename it before continuing.""" %
             raise FileExistsError("Target file %r already exists and overwrite set to %r" % (targetfn, overwrite))
 
     with zipfile.ZipFile(targetfn, mode="w") as zipfd:
-        for dirpath, dirnames, filenames in os.walk(directory):
-            for fname in filenames:
-                fpath = os.path.join(dirpath, fname)
-                arcname = os.path.relpath(fpath, start=directory) if relative else fpath
-                if verbose and verbose > 0:
-                    print(" - adding %r" % (arcname,))
-                zipfd.write(fpath, arcname=arcname, compress_type=compress_type)
-                filecount += 1
+        filecount = write_directory_to_zip(
+            zipfd, directory, relative=relative, compress_type=compress_type, date_time=date_time, verbose=verbose)
     if verbose and verbose > 0:
         print("\n%s files written to archive %r" % (filecount, targetfn))
     return targetfn
 
 
-def hash_file(filepath, method='md5', filemode='rb', single_read=None, blocksize=64*1024, digest='hexdigest'):
+def write_directory_to_zip(zipfd, directory, relative=True, compress_type=None, date_time=None, verbose=1):
+    """Write all files in a directory to an open ZipFile. Returns the number of files written.
+
+    Files are added in sorted order. If `date_time` is given, e.g. (1980, 1, 1, 0, 0, 0), it is used as the
+    timestamp of all members (instead of the file mtimes), so the archive only depends on the file contents.
     """
+    import zipfile
+    import shutil
+    if compress_type is None:
+        compress_type = zipfile.ZIP_DEFLATED
+    filecount = 0
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for fname in sorted(filenames):
+            fpath = os.path.join(dirpath, fname)
+            arcname = os.path.relpath(fpath, start=directory) if relative else fpath
+            if verbose and verbose > 0:
+                print(" - adding %r" % (arcname,))
+            if date_time is None:
+                zipfd.write(fpath, arcname=arcname, compress_type=compress_type)
+            else:
+                zinfo = zipfile.ZipInfo.from_file(fpath, arcname=arcname)
+                zinfo.date_time = date_time
+                zinfo.external_attr = 0o100644 << 16  # Regular file, rw-r--r--
+                zinfo.compress_type = compress_type
+                with open(fpath, 'rb') as src, zipfd.open(zinfo, 'w') as dst:
+                    shutil.copyfileobj(src, dst, 1024*1024)
+            filecount += 1
+    return filecount
+
+
+class NullWriter:
+    """Unseekable, write-only file object that discards everything written to it."""
+
+    def write(self, b):
+        return len(b)
+
+    def flush(self):
+        pass
+
+
+# Hash methods in addition to the algorithms provided by hashlib:
+# * 'git-sha1', 'git-sha256': Git blob object ids, as listed by e.g. `git ls-files -s` (for SHA-1 and SHA-256 repos).
+# * 'blake2b-<bits>': BLAKE2b with a small digest, e.g. 'blake2b-64'. Faster than md5 on 64-bit platforms.
+GIT_HASH_METHODS = {'git-sha1': 'sha1', 'git-sha256': 'sha256'}
+
+
+def new_hasher(method='md5', size=None):
+    """Create a new hasher object for the given hash method.
 
     Args:
-        filepath:
-        method:
-        filemode:
-        single_read:
-        blocksize:
-        digest:
+        method: Name of a hashlib algorithm, a key in `GIT_HASH_METHODS`, 'blake2b-<bits>', or a hasher constructor.
+        size: The size of the data to be hashed. Required by the git blob hash methods.
+
+    Returns:
+        hasher object with `update()` and `hexdigest()` methods.
+    """
+    import hashlib
+    if not isinstance(method, str):
+        return method()
+    if method in GIT_HASH_METHODS:
+        if size is None:
+            raise ValueError("Hash method %r requires the size of the data to be hashed." % (method,))
+        hasher = hashlib.new(GIT_HASH_METHODS[method])
+        hasher.update(b"blob %d\0" % size)
+        return hasher
+    if method.startswith('blake2b-'):
+        bits = method.split('-', 1)[1]
+        if not bits.isdigit() or int(bits) % 8 or not 8 <= int(bits) <= 512:
+            raise ValueError(
+                "Invalid hash method %r: The blake2b digest size must be a multiple of 8 bits, "
+                "between 8 and 512, e.g. 'blake2b-64'." % (method,))
+        return hashlib.blake2b(digest_size=int(bits) // 8)
+    return hashlib.new(method)
+
+
+def hash_file(filepath, method='md5', filemode='rb', single_read=None, blocksize=64*1024, digest='hexdigest'):
+    """Calculate the hash of a file.
+
+    Args:
+        filepath: The file to hash.
+        method: The hash method, c.f. `new_hasher`, e.g. 'md5', 'git-sha1', or 'blake2b-64'.
+        filemode: The mode used to open the file.
+        single_read: Read the whole file in a single read. Default is to do this for files smaller than 1 MiB.
+        blocksize: The blocksize used when reading the file in chunks.
+        digest: The name of the digest method to call, a function taking the hasher,
+            or None to return the hasher itself.
 
     Returns:
+        hexdigest str (by default).
 
     Refs:
     * https://stackoverflow.com/questions/1131220/get-md5-hash-of-big-files-in-python
     * https://stackoverflow.com/questions/22058048/hashing-a-file-in-python
     * http://pythoncentral.io/hashing-files-with-python/
+    * https://git-scm.com/book/en/v2/Git-Internals-Git-Objects
     """
-    if isinstance(method, str):
-        method = getattr(hashlib, method)
-    hasher = method()
-    if single_read is None:
-        # If file is small, just read the whole file in a single read:
-        single_read = os.path.getsize(filepath) < 2**20
     with open(filepath, mode=filemode) as fd:
+        size = os.fstat(fd.fileno()).st_size
+        hasher = new_hasher(method, size=size)
+        if single_read is None:
+            # If file is small, just read the whole file in a single read:
+            single_read = size < 2**20
         if single_read:
             hasher.update(fd.read())
         else:
@@ -262,11 +340,87 @@ def hash_file(filepath, method='md5', filemode='rb', single_read=None, blocksize
         return digest(hasher)
 
 
+def git_index_hashes(cwd=None):
+    """Return {path: blob_id} for files that are unmodified in the git worktree compared to the index.
+
+    Uses `git ls-files -s` and `git diff-files`, which rely on git's own lstat cache,
+    so the files are not read. Paths are relative to `cwd`, normalized with `os.path.normpath`.
+    Returns an empty dict if `cwd` is not inside a git worktree.
+    """
+    import subprocess
+    try:
+        # stdout/stderr=PIPE rather than capture_output, which requires Python 3.7:
+        staged = subprocess.run(
+            ["git", "ls-files", "-s", "-z"],
+            cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+        modified = subprocess.run(
+            ["git", "diff-files", "--name-only", "--relative", "-z"],
+            cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {}
+    modified = {os.path.normpath(p) for p in os.fsdecode(modified).split("\0") if p}
+    hashes = {}
+    for entry in os.fsdecode(staged).split("\0"):
+        if not entry:
+            continue
+        # "<mode> <object> <stage>\t<path>"
+        info, path = entry.split("\t", 1)
+        mode, blob_id, stage = info.split()
+        path = os.path.normpath(path)
+        if stage == "0" and path not in modified:
+            hashes[path] = blob_id
+    return hashes
+
+
+def zip_members(zipfd):
+    """Return {arcname: {'crc': crc32, 'size': file_size}} for all file members of an open ZipFile.
+
+    Only the zip central directory is read; no members are decompressed.
+    """
+    return {
+        info.filename: {'crc': info.CRC, 'size': info.file_size}
+        for info in zipfd.infolist() if not info.is_dir()
+    }
+
+
+def members_hexdigest(members, method='md5'):
+    """Return the hash of the sorted (arcname, crc, size) entries of a `zip_members` dict.
+
+    Unlike the hash of the zip file itself, this does not depend on member order, timestamps,
+    or the compression (which differs between zlib builds), only on the uncompressed member data.
+    """
+    data = "".join(
+        "%s\0%08x\0%d\n" % (name, members[name]['crc'], members[name]['size']) for name in sorted(members)
+    ).encode('utf-8')
+    hasher = new_hasher(method, size=len(data))
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def crc32_file(filepath, blocksize=64*1024):
+    """Calculate the zip-compatible CRC-32 checksum of a file."""
+    crc = 0
+    with open(filepath, 'rb') as fd:
+        for b in iter(lambda: fd.read(blocksize), b''):
+            crc = zlib.crc32(b, crc)
+    return crc
+
+
+def decode_xml(data):
+    """Decode XML bytes to str: UTF-16 if the data starts with a UTF-16 byte order mark, else UTF-8."""
+    import codecs
+    if isinstance(data, str):
+        return data
+    if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return data.decode('utf-16')
+    return data.decode('utf-8-sig')
+
+
 def prettyprint_xml(text, method='stdlib-xml', indent=" "*4):
     """
 
     Args:
-        text:
+        text: XML str, or bytes (the encoding is then detected from the byte order mark / XML declaration).
         method:
 
     Returns:
@@ -306,7 +460,7 @@ def prettyprint_xml(text, method='stdlib-xml', indent=" "*4):
     elif method == 'vkbeautify':
         # https://stackoverflow.com/a/41455013/3241277
         import vkbeautify
-        pretty = vkbeautify.xml(text)
+        pretty = vkbeautify.xml(decode_xml(text))
     elif method in ('beautifulsoup', 'bs'):
         # https://stackoverflow.com/a/39482716/3241277
         import bs4
@@ -315,15 +469,46 @@ def prettyprint_xml(text, method='stdlib-xml', indent=" "*4):
     elif method == 'yattag':
         # https://stackoverflow.com/a/23634596/3241277
         import yattag
-        pretty = yattag.indent(text)
+        pretty = yattag.indent(decode_xml(text))
     else:  # if method == 'stdlib-xml':
         # https://stackoverflow.com/a/749839/3241277
         import xml.dom.minidom
-        print("Converting text", type(text))
-        print("indent: %r" % indent)
         tree = xml.dom.minidom.parseString(text)
         pretty = tree.toprettyxml(indent=indent)
 
     return pretty
 
 
+def prettify_xml_file(inputfn, outputfn=None, method=None, indent=" "*4):
+    """Prettify a single XML file.
+
+    Args:
+        inputfn: The XML file to read.
+        outputfn: Write the prettified XML to this file (may be the same as inputfn).
+            If None, the prettified XML is returned instead.
+        method, indent: Passed to `prettyprint_xml`.
+
+    Returns:
+        The prettified XML str if outputfn is None, else outputfn.
+    """
+    # Read bytes, so the XML parser detects the encoding (OPC parts may be UTF-8 or UTF-16):
+    with open(inputfn, 'rb') as fd:
+        text = fd.read()
+    pretty = prettyprint_xml(text, method=method, indent=indent)
+    if outputfn is None:
+        return pretty
+    outputdir = os.path.dirname(outputfn)
+    if outputdir:
+        os.makedirs(outputdir, exist_ok=True)
+    with open(outputfn, 'w', encoding='utf-8') as fd:
+        fd.write(pretty)
+    return outputfn
+
+
+def find_xml_parts(directory, suffixes=XML_PART_SUFFIXES):
+    """Return a list of all XML part files in a directory tree, e.g. a store directory."""
+    return [
+        os.path.join(dirpath, fname)
+        for dirpath, dirnames, filenames in os.walk(directory)
+        for fname in filenames if fname.endswith(suffixes)
+    ]